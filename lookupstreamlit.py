@@ -1,8 +1,11 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import io
 import os
 import glob
 import logging
+from collections import namedtuple
 
 # =========================
 # 1. CONFIG & LOGGING SETUP
@@ -40,111 +43,248 @@ logging.basicConfig(
 def log_action(msg):
     logging.info(msg)
 
+# Prefer the parallel PyArrow CSV parser when available; fall back to the
+# default C engine otherwise.
+try:
+    import pyarrow  # noqa: F401
+    READ_CSV_KWARGS = {"engine": "pyarrow", "dtype_backend": "pyarrow"}
+except ImportError:
+    READ_CSV_KWARGS = {"encoding": "utf-8"}
+
 # ==============================
 # 2. LOAD & PREPARE THE DATA
 # ==============================
+
+# Cleaned tables are persisted as Parquet under data/.cache so warm starts of
+# a fresh worker skip CSV parsing and the cleaning passes entirely. A sidecar
+# hash file ties each Parquet to the source CSV's path/mtime/size.
+CACHE_DIR = os.path.join(DATA_DIR, ".cache")
+
+def _cache_paths(csv_path):
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    return (os.path.join(CACHE_DIR, base + ".parquet"),
+            os.path.join(CACHE_DIR, base + ".hash"))
+
+def _csv_fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return f"{csv_path}:{stat.st_mtime_ns}:{stat.st_size}"
+
+def _read_cached_parquet(csv_path):
+    """Returns the cached cleaned frame for csv_path, or None if stale/absent."""
+    parquet_path, hash_path = _cache_paths(csv_path)
+    try:
+        with open(hash_path, "r", encoding="utf-8") as f:
+            if f.read().strip() != _csv_fingerprint(csv_path):
+                return None
+        return pd.read_parquet(parquet_path, dtype_backend="pyarrow")
+    except Exception:
+        return None
+
+def _write_cached_parquet(csv_path, df):
+    """Best-effort write of the cleaned frame; failures only cost a warm start."""
+    parquet_path, hash_path = _cache_paths(csv_path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(parquet_path, compression="zstd")
+        with open(hash_path, "w", encoding="utf-8") as f:
+            f.write(_csv_fingerprint(csv_path))
+    except Exception as e:
+        log_action(f"Could not write parquet cache for {csv_path}: {e}")
+
+def _read_csv_named_cols(csv_path):
+    """
+    Reads a CSV keeping only real, named columns — trailing empty or
+    "Unnamed:" header fields are skipped at parse time. The pyarrow engine
+    wants an explicit column list, so peek at the header row first.
+    """
+    header_cols = pd.read_csv(csv_path, nrows=0).columns
+    keep_cols = [c for c in header_cols
+                 if str(c).strip() and not str(c).startswith("Unnamed:")]
+    return pd.read_csv(csv_path, usecols=keep_cols, **READ_CSV_KWARGS)
+
 @st.cache_data
 def load_data():
     """Loads the four CSVs and applies the same cleaning you had in Tkinter code."""
-    listings = pd.read_csv(listings_path, encoding="utf-8")
-    breakdowns = pd.read_csv(breakdowns_path, encoding="utf-8")
-    sc_desc = pd.read_csv(sc_desc_path, encoding="utf-8")
-    backup_desc = pd.read_csv(backup_desc_path, encoding="utf-8")
-    
-    # Remove extraneous "Unnamed:" columns from listings
-    listings = listings.loc[:, ~listings.columns.str.contains("Unnamed:")]
-
-    # Remove leading zeros from STOCK CODE
-    breakdowns["STOCK CODE"] = breakdowns["STOCK CODE"].apply(
-        lambda x: str(x).lstrip("0") if pd.notnull(x) else x
-    )
-    sc_desc["Stock Code1"] = sc_desc["Stock Code1"].apply(
-        lambda x: str(x).lstrip("0") if pd.notnull(x) else x
-    )
+    csv_paths = (listings_path, breakdowns_path, sc_desc_path, backup_desc_path)
+    cached = [_read_cached_parquet(p) for p in csv_paths]
+    if all(df is not None for df in cached):
+        listings, breakdowns, sc_desc, backup_desc = cached
+    else:
+        # listings and breakdowns both carry extraneous unnamed/empty columns
+        listings = _read_csv_named_cols(listings_path)
+        breakdowns = _read_csv_named_cols(breakdowns_path)
+        sc_desc = pd.read_csv(sc_desc_path, **READ_CSV_KWARGS)
+        backup_desc = pd.read_csv(backup_desc_path, **READ_CSV_KWARGS)
+
+        # Remove leading zeros from STOCK CODE (vectorized, NaN-safe)
+        breakdowns["STOCK CODE"] = breakdowns["STOCK CODE"].astype("string").str.lstrip("0")
+        sc_desc["Stock Code1"] = sc_desc["Stock Code1"].astype("string").str.lstrip("0")
+
+        # Remove "SC000" prefix (any case) from CU numbers in breakdowns
+        for col in ("CU", "CHILD CU"):
+            breakdowns[col] = breakdowns[col].astype("string").str.replace(
+                r"(?i)^sc000", "", regex=True
+            )
 
-    # Remove "SC000" prefix from CU numbers in breakdowns
-    def remove_sc000_prefix(val):
-        if isinstance(val, str) and val.lower().startswith("sc000"):
-            return val[5:]
-        return val
+        for csv_path, df in zip(csv_paths, (listings, breakdowns, sc_desc, backup_desc)):
+            _write_cached_parquet(csv_path, df)
 
-    breakdowns["CU"] = breakdowns["CU"].apply(remove_sc000_prefix)
-    breakdowns["CHILD CU"] = breakdowns["CHILD CU"].apply(remove_sc000_prefix)
+    # Repeated string values: store as category so equality and groupby
+    # compare integer codes. Applied after the cache branch so warm (Parquet)
+    # and cold (CSV) starts return identically-typed frames.
+    for col in ("CU", "CHILD CU", "STOCK CODE"):
+        breakdowns[col] = breakdowns[col].astype("category")
+    sc_desc["Stock Code1"] = sc_desc["Stock Code1"].astype("category")
+    listings["Description 2"] = listings["Description 2"].astype("category")
 
     return listings, breakdowns, sc_desc, backup_desc
 
+# Read-only lookup structures derived from the loaded tables. Built once per
+# process under st.cache_resource so reruns and other sessions share the same
+# in-memory objects without re-pickling them.
+Indices = namedtuple("Indices", [
+    "cu_index",        # CU -> np.ndarray of row indices into breakdowns
+    "has_stock",       # bool mask: row has a STOCK CODE
+    "has_child",       # bool mask: row has a CHILD CU
+    "child_col",       # CHILD CU column as a flat numpy array
+    "listings_by_cu",  # CU -> np.ndarray of row indices into listings
+    "sc_desc_idx",     # sc_desc keyed by stock code
+    "backup_idx",      # backup description Series keyed by stock code
+    "search_blob",     # lowercased per-row text blob of listings
+    "search_blob_np",  # same blob as a fixed-width numpy string array
+])
+
+@st.cache_resource
+def build_indices(breakdowns, listings, sc_desc, backup_desc):
+    """Builds the derived lookup indices for the cleaned tables."""
+    # Lookup structures for the breakdown traversal so we never re-scan the
+    # full DataFrame per CU: row indices grouped by CU, plus flat numpy
+    # views of the STOCK CODE / CHILD CU columns.
+    cu_index = breakdowns.groupby("CU", sort=False).indices
+    has_stock = breakdowns["STOCK CODE"].notna().to_numpy()
+    has_child = breakdowns["CHILD CU"].notna().to_numpy()
+    child_col = breakdowns["CHILD CU"].to_numpy()
+
+    # Same idea for the legend lookup: row indices in 'listings' grouped by
+    # CU so each lookup is a dict hit instead of a full-column scan.
+    listings_by_cu = listings.groupby(listings["Description 2"].astype(str), sort=False).indices
+
+    # Description tables keyed by stock code so SC metadata is a vectorized
+    # map instead of a full scan of sc_desc / backup_desc per stock code.
+    sc_desc_idx = (
+        sc_desc.assign(_k=sc_desc["Stock Code1"].astype(str))
+        .drop_duplicates("_k")
+        .set_index("_k")
+    )
+    backup_idx = (
+        backup_desc.assign(_k=backup_desc["SC_backup"].astype(str))
+        .drop_duplicates("_k")
+        .set_index("_k")["backupDescrip"]
+    )
+
+    # One lowercased text blob per listings row, so search is a single
+    # vectorized contains over one Series instead of a per-row apply.
+    # astype(str) keeps NA cells as NA, so blank them before joining.
+    search_blob = listings.astype(str).fillna("").agg(" ".join, axis=1).str.lower()
+    # Fixed-width numpy copy: np.char.find runs a compiled substring scan
+    # over it, skipping per-element object dispatch.
+    search_blob_np = search_blob.to_numpy(dtype=str)
+
+    return Indices(cu_index, has_stock, has_child, child_col,
+                   listings_by_cu, sc_desc_idx, backup_idx, search_blob,
+                   search_blob_np)
+
 listings, breakdowns, sc_desc, backup_desc = load_data()
+(cu_index, has_stock, has_child, child_col,
+ listings_by_cu, sc_desc_idx, backup_idx,
+ listings_search_blob, search_blob_np) = build_indices(breakdowns, listings, sc_desc, backup_desc)
 
 # =========================
 # 3. HELPER FUNCTIONS
 # =========================
 
+EMPTY_IDX = np.array([], dtype=np.int64)
+
+# Safety valve for malformed CU -> CHILD CU graphs: no legitimate breakdown
+# should touch anywhere near this many distinct CUs.
+MAX_BREAKDOWN_NODES = 100_000
+
 def recursive_breakdown(cu):
     """
-    Recursively gather STOCK CODE rows for a given CU from 'breakdowns'.
+    Gather STOCK CODE rows for a given CU from 'breakdowns', walking the
+    CU -> CHILD CU graph iteratively over the precomputed cu_index.
     Returns a dataframe with columns: [CU, CHILD CU, STOCK CODE, QTY, ...].
+    The 'seen' set skips CUs already visited (cycles in the data), and the
+    node limit bounds worst-case work if the graph is badly malformed.
     """
-    cu_str = str(cu)
-    # If CU not present, return empty
-    if cu_str not in breakdowns["CU"].values:
-        return pd.DataFrame(columns=breakdowns.columns)
+    out = []
+    stack = [str(cu)]
+    seen = set()
+
+    while stack:
+        current = stack.pop()
+        if current in seen:
+            continue
+        if len(seen) >= MAX_BREAKDOWN_NODES:
+            log_action(
+                f"Breakdown of CU {cu} aborted at {current}: "
+                f"over {MAX_BREAKDOWN_NODES} nodes visited (cyclic or malformed CU graph)"
+            )
+            break
+        seen.add(current)
 
-    subset = breakdowns[breakdowns["CU"] == cu_str]
-    result = pd.DataFrame(columns=breakdowns.columns)
+        idx = np.asarray(cu_index.get(current, EMPTY_IDX))
+        if idx.size == 0:
+            continue
 
-    for _, row in subset.iterrows():
-        child_cu = row["CHILD CU"]
-        stock_code = row["STOCK CODE"]
+        # Rows with a valid stock code go straight into the result
+        stock_rows = idx[has_stock[idx]]
+        if stock_rows.size:
+            out.append(stock_rows)
 
-        # If row has a CHILD CU but no STOCK CODE, we break it down further
-        if pd.isna(stock_code) and pd.notna(child_cu):
-            deeper = recursive_breakdown(child_cu)
-            result = pd.concat([result, deeper], ignore_index=True)
-        # If we have a valid stock code, add this row to results
-        elif pd.notna(stock_code):
-            result = pd.concat([result, pd.DataFrame([row])], ignore_index=True)
+        # Rows with a CHILD CU but no STOCK CODE get broken down further
+        child_rows = idx[has_child[idx] & ~has_stock[idx]]
+        for child_cu in child_col[child_rows]:
+            child_str = str(child_cu)
+            if child_str not in seen:
+                stack.append(child_str)
 
-    return result
-
-def get_sc_description(sc_id):
-    """
-    Return the SC's description, UOI, and Price from sc_desc or fallback to backup_desc.
-    If found in sc_desc, we prefer sc_desc. Otherwise, we try backup_desc for a description.
-    Returns a dict with keys: {'Description': ..., 'UOI': ..., 'Price': ...}.
-    """
-    sc_str = str(sc_id)
-
-    # Try main sc_desc
-    main_info = sc_desc[sc_desc["Stock Code1"].astype(str) == sc_str]
-    if not main_info.empty:
-        return {
-            "Description": main_info.iloc[0]["Description"],
-            "UOI": main_info.iloc[0].get("UOI", ""),
-            "Price": main_info.iloc[0].get("Price", "")
-        }
-
-    # Fallback to backup_desc
-    backup_info = backup_desc[backup_desc["SC_backup"].astype(str) == sc_str]
-    if not backup_info.empty:
-        return {
-            "Description": backup_info.iloc[0]["backupDescrip"],
-            "UOI": "",
-            "Price": ""
-        }
-
-    # Nothing found
-    return {
-        "Description": "No Description Found",
-        "UOI": "",
-        "Price": ""
-    }
+    if not out:
+        return breakdowns.iloc[:0]
+    return breakdowns.iloc[np.concatenate(out)]
 
 def get_cu_legend_info(cu):
     """
     Return all rows in 'listings' that match the given CU in 'Description 2'.
     (Adjust if your 'listings' is structured differently.)
     """
-    return listings[listings["Description 2"].astype(str) == str(cu)]
+    return listings.iloc[listings_by_cu.get(str(cu), EMPTY_IDX)]
+
+# Cap on rows sent to the browser per table; rendering cost scales linearly
+# with rows serialized over the websocket.
+MAX_DISPLAY_ROWS = 500
+
+def show_limited_dataframe(df, key):
+    """
+    Render a dataframe capped at MAX_DISPLAY_ROWS, with a checkbox to reveal
+    the full table, so huge result sets don't dominate rerun latency.
+    """
+    if len(df) <= MAX_DISPLAY_ROWS or st.checkbox(f"Show all {len(df)} rows", key=key):
+        st.dataframe(df, use_container_width=True)
+    else:
+        st.dataframe(df.head(MAX_DISPLAY_ROWS), use_container_width=True)
+        st.caption(f"Showing first {MAX_DISPLAY_ROWS} of {len(df)} rows.")
+
+@st.cache_data(show_spinner=False)
+def _to_csv_bytes(df, cu_id):
+    """
+    CSV-encodes a breakdown table once per CU instead of on every rerun.
+    Writes into a bytes buffer in chunks so large tables never hold a second
+    full-size Python string during encoding.
+    """
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8", chunksize=10_000)
+    return buf.getvalue()
 
 # =========================
 # 4. STREAMLIT UI
@@ -159,15 +299,20 @@ st.write("""
 """)
 
 # ---- A) SEARCH UI ----
-search_query = st.text_input("Search listings (case-insensitive):")
-if st.button("Search"):
+# st.form batches the widgets so the script only reruns on submit, not on
+# every keystroke or selection change.
+with st.form("search_form"):
+    search_query = st.text_input("Search listings (case-insensitive):")
+    search_submitted = st.form_submit_button("Search")
+
+if search_submitted:
     log_action(f"User searched for: {search_query}")
-    # Filter across all columns in listings
-    results = listings[listings.apply(
-        lambda row: row.astype(str).str.contains(search_query, case=False).any(),
-        axis=1
-    )]
-    st.session_state["search_results"] = results
+    # Filter across all columns in listings via the precomputed blob
+    mask = np.char.find(search_blob_np, search_query.lower()) >= 0
+    st.session_state["search_results"] = listings.iloc[np.flatnonzero(mask)]
+    # A new search invalidates any previously selected row's details
+    for key in ("selected_cu", "legend_df", "breakdown_df"):
+        st.session_state.pop(key, None)
 elif "search_results" not in st.session_state:
     st.session_state["search_results"] = pd.DataFrame()
 
@@ -176,13 +321,15 @@ if st.session_state["search_results"].empty:
     st.info("No search results. Enter a query and press Search.")
 else:
     st.write("### Search Results")
-    st.dataframe(st.session_state["search_results"], use_container_width=True)
+    show_limited_dataframe(st.session_state["search_results"], key="show_all_search")
 
     # Let user pick which row index to explore
     indices = st.session_state["search_results"].index.tolist()
-    selected_index = st.selectbox("Select a row index for CU breakdown:", options=indices)
+    with st.form("details_form"):
+        selected_index = st.selectbox("Select a row index for CU breakdown:", options=indices)
+        details_submitted = st.form_submit_button("Show Details for Selected Row")
 
-    if st.button("Show Details for Selected Row"):
+    if details_submitted:
         row_data = st.session_state["search_results"].loc[selected_index]
 
         # Identify the CU from your 'listings' row
@@ -191,41 +338,34 @@ else:
         if pd.isna(cu_id):
             # fallback: maybe the first column is the CU
             cu_id = row_data.iloc[0]
-        
-        st.write(f"**Selected CU:** {cu_id}")
 
-        # 1) Show CU Legend
+        # 1) Look up the CU Legend
         legend_df = get_cu_legend_info(cu_id)
-        if legend_df.empty:
-            st.warning("No CU legend found in listings for this CU.")
-        else:
-            st.write("### CU Legend (from `listings`)")
-            st.dataframe(legend_df, use_container_width=True)
 
-        # 2) Do the SC breakdown via recursion
+        # 2) Do the SC breakdown via the graph walk
         breakdown_df = recursive_breakdown(cu_id)
-        if breakdown_df.empty:
-            st.warning("No SC breakdown data found for this CU.")
-        else:
-            st.write("### SC Breakdown Details")
-
-            # We'll create new columns for SC's "Description", "UOI", "Price"
+        if not breakdown_df.empty:
+            # Pull SC's "Description", "UOI", "Price" in one left join
+            # against the keyed description table, falling back to
+            # backup_desc for codes missing from sc_desc.
             breakdown_df = breakdown_df.copy()  # avoid SettingWithCopy
-            desc_list = []
-            uoi_list = []
-            price_list = []
-
-            for _, b_row in breakdown_df.iterrows():
-                sc_id = b_row["STOCK CODE"]
-                # Use your helper function
-                details = get_sc_description(sc_id)
-                desc_list.append(details["Description"])
-                uoi_list.append(details["UOI"])
-                price_list.append(details["Price"])
-
-            breakdown_df["SC Description"] = desc_list
-            breakdown_df["UOI"] = uoi_list
-            breakdown_df["Price"] = price_list
+            breakdown_df["_k"] = breakdown_df["STOCK CODE"].astype(str)
+
+            meta = sc_desc_idx.reindex(columns=["Description", "UOI", "Price"]).rename(
+                columns={"Description": "SC Description"}
+            )
+            breakdown_df = breakdown_df.merge(meta, left_on="_k", right_index=True, how="left")
+
+            desc = breakdown_df["SC Description"]
+            desc = desc.mask(desc.isna(), breakdown_df["_k"].map(backup_idx))
+            breakdown_df["SC Description"] = desc.fillna("No Description Found")
+            # Blank out missing UOI/Price only for string columns; a numeric
+            # Price (e.g. under the pyarrow backend) can't hold "" and reads
+            # fine as NaN in the table.
+            for col in ("UOI", "Price"):
+                if not pd.api.types.is_numeric_dtype(breakdown_df[col]):
+                    breakdown_df[col] = breakdown_df[col].fillna("")
+            breakdown_df = breakdown_df.drop(columns="_k")
 
             # Show final table with relevant columns
             # You can reorder columns as you wish
@@ -242,10 +382,35 @@ else:
             final_cols = [c for c in final_cols if c in breakdown_df.columns]
             breakdown_df = breakdown_df[final_cols]
 
-            st.dataframe(breakdown_df, use_container_width=True)
+        # Persist the details so they survive plain reruns (e.g. toggling a
+        # show-all checkbox below), which submit no form.
+        st.session_state["selected_cu"] = cu_id
+        st.session_state["legend_df"] = legend_df
+        st.session_state["breakdown_df"] = breakdown_df
+
+    if "selected_cu" in st.session_state:
+        cu_id = st.session_state["selected_cu"]
+        legend_df = st.session_state["legend_df"]
+        breakdown_df = st.session_state["breakdown_df"]
+
+        st.write(f"**Selected CU:** {cu_id}")
+
+        # 1) Show CU Legend
+        if legend_df.empty:
+            st.warning("No CU legend found in listings for this CU.")
+        else:
+            st.write("### CU Legend (from `listings`)")
+            show_limited_dataframe(legend_df, key="show_all_legend")
+
+        # 2) Show the SC breakdown
+        if breakdown_df.empty:
+            st.warning("No SC breakdown data found for this CU.")
+        else:
+            st.write("### SC Breakdown Details")
+            show_limited_dataframe(breakdown_df, key="show_all_breakdown")
 
             # 3) Optional: Download breakdown as CSV
-            csv_bytes = breakdown_df.to_csv(index=False).encode("utf-8")
+            csv_bytes = _to_csv_bytes(breakdown_df, str(cu_id))
             st.download_button(
                 label="Download Breakdown as CSV",
                 data=csv_bytes,